@@ -8,8 +8,12 @@ Code below written by:
 Greg Ver Steeg (gregv@isi.edu), 2017.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy.stats import norm, rankdata
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+from scipy.linalg.blas import get_blas_funcs
 import gc
 try:
     import cudamat as cm
@@ -17,6 +21,11 @@ try:
 except:
     print("Install CUDA and cudamat (for python) to enable GPU speedups.")
     GPU_SUPPORT = False
+try:
+    from numba import njit, prange
+    NUMBA_SUPPORT = True
+except ImportError:
+    NUMBA_SUPPORT = False
 
 
 class Corex(object):
@@ -51,6 +60,10 @@ class Corex(object):
     verbose : int, optional
         Print verbose outputs.
 
+    dtype : numpy dtype, default = np.float32
+        Precision used for the data, weights, and moments during optimization. The small m by m
+        solves are always done in double precision.
+
     seed : integer or numpy.RandomState, optional
         A random number generator instance to define the state of the
         random permutations generator. If an integer is given, it fixes the
@@ -68,10 +81,14 @@ class Corex(object):
     [3] Greg Ver Steeg and Aram Galstyan. "Low Complexity Gaussian Latent Factor Models and
                                            a Blessing of Dimensionality", 2017.
     """
+    # Class level defaults, so that models pickled by older versions still load
+    _xT = None  # Contiguous copy of x.T, only kept while fitting
+    _xtx = None  # Gram matrix x.T.dot(x), only kept while fitting when n_samples > nv
+    dtype = np.float32  # The precision used before dtype became a parameter
 
     def __init__(self, n_hidden=10, max_iter=10000, tol=1e-5, anneal=True, missing_values=None,
                  discourage_overlap=True, gaussianize='standard', gpu=False,
-                 verbose=False, seed=None):
+                 verbose=False, seed=None, dtype=np.float32):
         self.m = n_hidden  # Number of latent factors to learn
         self.max_iter = max_iter  # Number of iterations to try
         self.tol = tol  # Threshold for convergence
@@ -82,6 +99,7 @@ class Corex(object):
         self.discourage_overlap = discourage_overlap  # Whether or not to discourage overlapping latent factors
         self.gaussianize = gaussianize  # Preprocess data: 'standard' scales to zero mean and unit variance
         self.gpu = gpu  # Enable GPU support for some large matrix multiplications.
+        self.dtype = dtype  # Floating point precision for data, weights, and moments
         if self.gpu:
             cm.cublas_init()
 
@@ -105,70 +123,77 @@ class Corex(object):
         return self.transform(x)
 
     def fit(self, x):
-        x = np.asarray(x, dtype=np.float32)
         x = self.preprocess(x, fit=True)  # Fit a transform for each marginal
         self.n_samples, self.nv = x.shape  # Number of samples, variables in input data
-        if self.m is None:
-            self.m = pick_n_hidden(x)
-        anneal_schedule = [0.]
-        if self.ws.size == 0:  # Randomly initialize weights if not already set
-            if self.discourage_overlap:
-                self.ws = np.random.randn(self.m, self.nv).astype(np.float32)
-                self.ws /= (10. * self._norm(x, self.ws))[:, np.newaxis]  # TODO: test good IC
-                if self.anneal:
-                    anneal_schedule = [0.6**k for k in range(1, 7)] + [0]
+        if not self.gpu:
+            if self.n_samples > self.nv:  # Products with the nv by nv Gram matrix are cheaper than with x
+                self._xtx = _gram(x)
             else:
-                self.ws = np.random.randn(self.m, self.nv) * self.yscale ** 2 / np.sqrt(self.nv)
-        self.moments = self._calculate_moments(x, self.ws, quick=True)
-
-        for i_eps, eps in enumerate(anneal_schedule):
-            self.eps = eps
-            if i_eps > 0:
-                eps0 = anneal_schedule[i_eps - 1]
-                mag = (1 - self.yscale**2 / self.moments['Y_j^2']).clip(1e-5)  # May be better to re-initialize un-used latent factors (i.e. yj^2=self.yscale**2)?
-                wmag = np.sum(self.ws**2, axis=1)
-                self.ws *= np.sqrt((1 - eps0**2) / (1 - eps**2 - (eps0**2 - eps**2) * wmag / mag))[:, np.newaxis]
+                self._xT = np.ascontiguousarray(x.T)  # x is fixed during fit, so transpose it once
+        try:
+            if self.m is None:
+                self.m = pick_n_hidden(x)
+            anneal_schedule = [0.]
+            if self.ws.size == 0:  # Randomly initialize weights if not already set
+                if self.discourage_overlap:
+                    self.ws = np.random.randn(self.m, self.nv).astype(self.dtype)
+                    self.ws /= (10. * self._norm(x, self.ws))[:, np.newaxis]  # TODO: test good IC
+                    if self.anneal:
+                        anneal_schedule = [0.6**k for k in range(1, 7)] + [0]
+                else:
+                    self.ws = (np.random.randn(self.m, self.nv) * self.yscale ** 2 / np.sqrt(self.nv)).astype(self.dtype)
             self.moments = self._calculate_moments(x, self.ws, quick=True)
 
-            for i_loop in range(self.max_iter):
-                last_tc = self.tc  # Save this TC to compare to possible updates
-                if self.discourage_overlap:
-                    self.ws, self.moments = self._update_ns(x)
+            for i_eps, eps in enumerate(anneal_schedule):
+                self.eps = eps
+                if i_eps > 0:
+                    eps0 = anneal_schedule[i_eps - 1]
+                    mag = (1 - self.yscale**2 / self.moments['Y_j^2']).clip(1e-5)  # May be better to re-initialize un-used latent factors (i.e. yj^2=self.yscale**2)?
+                    wmag = np.sum(self.ws**2, axis=1)
+                    self.ws *= np.sqrt((1 - eps0**2) / (1 - eps**2 - (eps0**2 - eps**2) * wmag / mag))[:, np.newaxis]
+                self.moments = self._calculate_moments(x, self.ws, quick=True)
+
+                for i_loop in range(self.max_iter):
+                    last_tc = self.tc  # Save this TC to compare to possible updates
+                    if self.discourage_overlap:
+                        self.ws, self.moments = self._update_ns(x)
+                    else:
+                        self.ws, self.moments = self._update_syn(x, eta=0.1)  # Older method that allows synergies
+
+                    # assert np.isfinite(self.tc), "Error: TC is no longer finite: {}".format(self.tc)
+                    if not self.moments or not np.isfinite(self.tc):
+                        try:
+                            print(("Error: TC is no longer finite: {}".format(self.tc)))
+                        except:
+                            print("Error... updates giving invalid solutions?")
+                            return self
+                    delta = np.abs(self.tc - last_tc)
+                    self.update_records(self.moments, delta)  # Book-keeping
+                    if delta < self.tol:  # Check for convergence
+                        if self.verbose:
+                            print(('{:d} iterations to tol: {:f}'.format(i_loop, self.tol)))
+                        break
                 else:
-                    self.ws, self.moments = self._update_syn(x, eta=0.1)  # Older method that allows synergies
-
-                # assert np.isfinite(self.tc), "Error: TC is no longer finite: {}".format(self.tc)
-                if not self.moments or not np.isfinite(self.tc):
-                    try:
-                        print(("Error: TC is no longer finite: {}".format(self.tc)))
-                    except:
-                        print("Error... updates giving invalid solutions?")
-                        return self
-                delta = np.abs(self.tc - last_tc)
-                self.update_records(self.moments, delta)  # Book-keeping
-                if delta < self.tol:  # Check for convergence
                     if self.verbose:
-                        print(('{:d} iterations to tol: {:f}'.format(i_loop, self.tol)))
-                    break
-            else:
-                if self.verbose:
-                    print(("Warning: Convergence not achieved in {:d} iterations. "
-                          "Final delta: {:f}".format(self.max_iter, delta.sum())))
-        self.moments = self._calculate_moments(x, self.ws, quick=False)  # Update moments with details
-        order = np.argsort(-self.moments["TCs"])  # Largest TC components first.
-        self.ws = self.ws[order]
-        self.moments = self._calculate_moments(x, self.ws, quick=False)  # Update moments based on sorted weights.
-        return self
+                        print(("Warning: Convergence not achieved in {:d} iterations. "
+                              "Final delta: {:f}".format(self.max_iter, delta.sum())))
+            self.moments = self._calculate_moments(x, self.ws, quick=False)  # Update moments with details
+            order = np.argsort(-self.moments["TCs"])  # Largest TC components first.
+            self.ws = self.ws[order]
+            self.moments = _permute_moments(self.moments, order)  # Same as recalculating moments for the sorted weights
+            return self
+        finally:
+            self._xT, self._xtx = None, None  # Never keep training data caches past fit
 
     def update_records(self, moments, delta):
         """Print and store some statistics about each iteration."""
         gc.disable()  # There's a bug that slows when appending, fixed by temporarily disabling garbage collection
-        self.history["TC"] = self.history.get("TC", []) + [moments["TC"]]
+        self.history.setdefault("TC", []).append(moments["TC"])  # Append in place, don't copy the list
         if self.verbose > 1:
             print(("TC={:.3f}\tadd={:.3f}\tdelta={:.6f}".format(moments["TC"], moments.get("additivity", 0), delta)))
         if self.verbose:
-            self.history["additivity"] = self.history.get("additivity", []) + [moments.get("additivity", 0)]
-            self.history["TCs"] = self.history.get("TCs", []) + [moments.get("TCs", np.zeros(self.m))]
+            self.history.setdefault("additivity", []).append(moments.get("additivity", 0))
+            self.history.setdefault("TCs", []).append(moments.get("TCs", np.zeros(self.m)))
         gc.enable()
 
     @property
@@ -185,14 +210,24 @@ class Corex(object):
 
     @property
     def mis(self):
-        return - 0.5 * np.log1p(-self.moments["rho"]**2)
+        """MI between each latent factor and each variable. Cached in the moments, which are replaced when they change."""
+        if "MI" not in self.moments:
+            self.moments["MI"] = _mi(self.moments["rho"])
+        return self.moments["MI"]
 
     def clusters(self):
         return np.argmax(np.abs(self.ws), axis=0)
 
+    def _transpose(self, x):
+        """Return x.T. While fitting, x is the training data and a cached contiguous copy is used."""
+        if self._xT is None:
+            return x.T
+        return self._xT
+
     def _sig(self, x, u):
         """Multiple the matrix u by the covariance matrix of x. We are interested in situations where
-        n_variables >> n_samples, so we do this without explicitly constructing the covariance matrix."""
+        n_variables >> n_samples, so we do this without explicitly constructing the covariance matrix,
+        unless fit has cached the Gram matrix because n_samples > n_variables."""
         if self.gpu:
             y = cm.empty((self.n_samples, self.m))
             uc = cm.CUDAMatrix(u)
@@ -203,9 +238,11 @@ class Corex(object):
             tmp_dot = tmp.asarray()
             del y
             del tmp
+        elif self._xtx is not None:
+            tmp_dot = self._xtx.dot(u.T)
         else:
             y = x.dot(u.T)
-            tmp_dot = x.T.dot(y)
+            tmp_dot = self._transpose(x).dot(y)
         prod = (1 - self.eps**2) * tmp_dot.T / self.n_samples + self.eps**2 * u  # nv by m,  <X_i Y_j> / std Y_j
         return prod
 
@@ -218,10 +255,12 @@ class Corex(object):
             y_local = y.asarray()
             del y
             del wc
-            tmp_sum = np.einsum('lj,lj->j', y_local, y_local)  # TODO: Should be able to do on gpu...
+            tmp_sum = np.sum(y_local**2, axis=0)  # TODO: Should be able to do on gpu...
+        elif self._xtx is not None:
+            tmp_sum = np.sum(ws.T * self._xtx.dot(ws.T), axis=0)
         else:
             y = x.dot(ws.T)  # + noise / std Y_j^2, but it is included analytically
-            tmp_sum = np.einsum('lj,lj->j', y, y)
+            tmp_sum = np.sum(y**2, axis=0)
         return np.sqrt((1 - self.eps**2) * tmp_sum / self.n_samples + self.eps**2 * np.sum(ws**2, axis=1))
 
     def _calculate_moments(self, x, ws, quick=False):
@@ -239,10 +278,14 @@ class Corex(object):
             wc = cm.CUDAMatrix(ws)
             cm.dot(x, wc.T, target=y)  # + noise, but it is included analytically
             del wc
-            tmp_sum = np.einsum('lj,lj->j', y.asarray(), y.asarray())  # TODO: Should be able to do on gpu...
+            y_local = y.asarray()
+            tmp_sum = np.sum(y_local**2, axis=0)  # TODO: Should be able to do on gpu...
+        elif self._xtx is not None:
+            tmp_dot = self._xtx.dot(ws.T)  # Equal to x.T.dot(y), without forming y
+            tmp_sum = np.sum(ws.T * tmp_dot, axis=0)
         else:
             y = x.dot(ws.T)
-            tmp_sum = np.einsum('lj,lj->j', y, y)
+            tmp_sum = np.sum(y**2, axis=0)
         m["uj"] = (1 - self.eps**2) * tmp_sum / self.n_samples + self.eps**2 * np.sum(ws**2, axis=1)
         if quick and np.max(m["uj"]) >= 1.:
             return False
@@ -252,8 +295,8 @@ class Corex(object):
             tmp_dot = tmp.asarray()
             del tmp
             del y
-        else:
-            tmp_dot = x.T.dot(y)
+        elif self._xtx is None:
+            tmp_dot = self._transpose(x).dot(y)
         m["rho"] = (1 - self.eps**2) * tmp_dot.T / self.n_samples + self.eps**2 * ws  # m by nv
         m["ry"] = ws.dot(m["rho"].T)  # normalized covariance of Y
         m["Y_j^2"] = self.yscale ** 2 / (1. - m["uj"])
@@ -261,21 +304,28 @@ class Corex(object):
         m["invrho"] = 1. / (1. - m["rho"]**2)
         m["rhoinvrho"] = m["rho"] * m["invrho"]
         m["Qij"] = np.dot(m['ry'], m["rhoinvrho"])
-        m["Qi"] = np.einsum('ki,ki->i', m["rhoinvrho"], m["Qij"])
+        m["Qi"] = np.sum(m["rhoinvrho"] * m["Qij"], axis=0)
         #m["Qi-Si^2"] = np.einsum('ki,ki->i', m["rhoinvrho"], m["Qij"])
         m["Si"] = np.sum(m["rho"] * m["rhoinvrho"], axis=0)
 
         # This is the objective, a lower bound for TC
-        m["TC"] = np.sum(np.log(1 + m["Si"])) \
-                     - 0.5 * np.sum(np.log(1 - m["Si"]**2 + m["Qi"])) \
+        # log(1 + Si) - 0.5 * log(1 - Si^2 + Qi), with one log per variable
+        m["TC"] = 0.5 * np.sum(np.log((1 + m["Si"])**2 / (1 - m["Si"]**2 + m["Qi"]))) \
                      + 0.5 * np.sum(np.log(1 - m["uj"]))
 
         if not quick:
-            m["MI"] = - 0.5 * np.log1p(-m["rho"]**2)
+            m["MI"] = _mi(m["rho"])
             m["X_i Y_j"] = m["rho"].T * np.sqrt(m["Y_j^2"])
-            m["X_i Z_j"] = np.linalg.solve(m["ry"], m["rho"]).T
-            m["X_i^2 | Y"] = (1. - np.einsum('ij,ji->i', m["X_i Z_j"], m["rho"])).clip(1e-6)
-            m['I(Y_j ; X)'] = 0.5 * np.log(m["Y_j^2"]) - 0.5 * np.log(self.yscale ** 2)
+            # ry is a positive semi-definite matrix with diagonal uj, plus diag(1 - uj) from the noise. So it is
+            # positive definite only if every uj < 1. The quick check ensures that during fit, but not when
+            # transform(details=True) is called on new data, so fall back to a general solve in that case.
+            try:
+                c = cho_factor(m["ry"].astype(np.float64), lower=True, check_finite=False)  # Solve in double precision
+                m["X_i Z_j"] = cho_solve(c, m["rho"], check_finite=False).T.astype(self.dtype)
+            except LinAlgError:
+                m["X_i Z_j"] = np.linalg.solve(m["ry"], m["rho"]).T
+            m["X_i^2 | Y"] = (1. - np.sum(m["X_i Z_j"] * m["rho"].T, axis=1)).clip(1e-6)
+            m['I(Y_j ; X)'] = 0.5 * np.log(m["Y_j^2"] / self.yscale ** 2)
             m['I(X_i ; Y)'] = - 0.5 * np.log(m["X_i^2 | Y"])
             m["TCs"] = m["MI"].sum(axis=1) - m['I(Y_j ; X)']
             m["TC_no_overlap"] = m["MI"].max(axis=0).sum() - m['I(Y_j ; X)'].sum()  # A direct calculation of TC where each variable is in exactly one group.
@@ -289,25 +339,26 @@ class Corex(object):
         rj = 1. - m["uj"][:, np.newaxis]
         H = np.dot(m["rhoinvrho"] / (1 + m["Qi"] - m["Si"]**2), m["rhoinvrho"].T)
         np.fill_diagonal(H, 0)
-        grad = self.ws / rj
-        grad -= 2 * m["invrho"] * m["rhoinvrho"] / (1 + m["Si"])
-        grad += m["invrho"]**2 * \
-               ((1 + m["rho"]**2) * m["Qij"] - 2 * m["rho"] * m["Si"]) / (1 - m["Si"]**2 + m["Qi"])
+        grad = _grad_ns(self.ws, m["uj"], m["rho"], m["invrho"], m["rhoinvrho"], m["Qij"], m["Qi"], m["Si"])
         grad += np.dot(H, self.ws)
         sig_grad = self._sig(x, grad)
         Bj = np.sum(m["rho"] * grad, axis=1, keepdims=True)
-        update = - rj * (grad - 2. * self.ws / (2 - rj) * Bj)  # Gamma Hess^-1 Grad
-        update = np.where(rj < 1e-6, 0, update)
+        update = grad  # Gamma Hess^-1 Grad = - rj * (grad - 2. * self.ws / (2 - rj) * Bj), computed in place
+        update -= 2. * Bj / (2 - rj) * self.ws
+        update *= -rj
+        update[rj[:, 0] < 1e-6] = 0
 
         backtrack = True
         eta = 1.
-        update_tangent = np.einsum('ji,ji', sig_grad, update)
+        update_tangent = np.vdot(sig_grad, update)
+        w_update = np.empty_like(update)  # Reused for each step size tried
         while backtrack:
             if eta < min(self.tol, 1e-10):
                 if self.verbose:
                     print('Warning: step size becoming too small')
                 break
-            w_update = self.ws + eta * update
+            np.multiply(update, eta, out=w_update)
+            w_update += self.ws
             m_update = self._calculate_moments_ns(x, w_update, quick=True)
             if not m_update:  # TEST 1: Make sure rho is a valid solution, if not m_update will return False
                 eta *= 0.5
@@ -332,7 +383,7 @@ class Corex(object):
             wc = cm.CUDAMatrix(ws)
             cm.dot(x, wc.T, target=y)  # + noise, but it is included analytically
             del wc
-        else:
+        elif self._xtx is None:
             y = x.dot(ws.T)  # + noise, but it is included analytically
         if self.gpu:
             tmp_dot = cm.empty((self.nv, self.m))
@@ -340,22 +391,27 @@ class Corex(object):
             m["X_i Y_j"] = tmp_dot.asarray() / self.n_samples  # nv by m,  <X_i Y_j>
             del y
             del tmp_dot
+        elif self._xtx is not None:
+            m["X_i Y_j"] = self._xtx.dot(ws.T) / self.n_samples
         else:
-            m["X_i Y_j"] = x.T.dot(y) / self.n_samples
-        m["cy"] = ws.dot(m["X_i Y_j"]) + self.yscale ** 2 * np.eye(self.m)  # cov(y.T), m by m
+            m["X_i Y_j"] = self._transpose(x).dot(y) / self.n_samples
+        m["cy"] = ws.dot(m["X_i Y_j"]) + self.yscale ** 2 * np.eye(self.m, dtype=self.dtype)  # cov(y.T), m by m
+        m["cy"] = 0.5 * (m["cy"] + m["cy"].T)  # Symmetric positive definite up to rounding
         m["Y_j^2"] = np.diag(m["cy"]).copy()
-        m["ry"] = m["cy"] / (np.sqrt(m["Y_j^2"]) * np.sqrt(m["Y_j^2"][:, np.newaxis]))
-        m["rho"] = (m["X_i Y_j"] / np.sqrt(m["Y_j^2"])).T
+        std_y = np.sqrt(m["Y_j^2"])
+        m["ry"] = m["cy"] / (std_y * std_y[:, np.newaxis])
+        m["rho"] = (m["X_i Y_j"] / std_y).T
         m["invrho"] = 1. / (1. - m["rho"]**2)
         m["rhoinvrho"] = m["rho"] * m["invrho"]
         m["Qij"] = np.dot(m['ry'], m["rhoinvrho"])
-        m["Qi"] = np.einsum('ki,ki->i', m["rhoinvrho"], m["Qij"])
+        m["Qi"] = np.sum(m["rhoinvrho"] * m["Qij"], axis=0)
         m["Si"] = np.sum(m["rho"] * m["rhoinvrho"], axis=0)
 
-        m["MI"] = - 0.5 * np.log1p(-m["rho"]**2)
-        m["X_i Z_j"] = np.linalg.solve(m["cy"], m["X_i Y_j"].T).T
-        m["X_i^2 | Y"] = (1. - np.einsum('ij,ij->i', m["X_i Z_j"], m["X_i Y_j"])).clip(1e-6)
-        mi_yj_x = 0.5 * np.log(m["Y_j^2"]) - 0.5 * np.log(self.yscale ** 2)
+        m["MI"] = _mi(m["rho"])
+        c = cho_factor(m["cy"].astype(np.float64), lower=True, check_finite=False)  # Solve in double precision
+        m["X_i Z_j"] = cho_solve(c, m["X_i Y_j"].T, check_finite=False).T.astype(self.dtype)
+        m["X_i^2 | Y"] = (1. - np.sum(m["X_i Z_j"] * m["X_i Y_j"], axis=1)).clip(1e-6)
+        mi_yj_x = 0.5 * np.log(m["Y_j^2"] / self.yscale ** 2)
         mi_xi_y = - 0.5 * np.log(m["X_i^2 | Y"])
         m["TCs"] = m["MI"].sum(axis=1) - mi_yj_x
         m["additivity"] = (m["MI"].sum(axis=0) - mi_xi_y).sum()
@@ -368,8 +424,10 @@ class Corex(object):
         H = (1. / m["X_i^2 | Y"] * m["X_i Z_j"].T).dot(m["X_i Z_j"])
         np.fill_diagonal(H, 0)
         R = m["X_i Z_j"].T / m["X_i^2 | Y"]
-        S = np.dot(H, self.ws)
-        ws = (1. - eta) * self.ws + eta * (R - S)
+        R -= np.dot(H, self.ws)
+        R *= eta
+        ws = (1. - eta) * self.ws
+        ws += R
         m = self._calculate_moments_syn(x, ws)
         return ws, m
 
@@ -390,6 +448,7 @@ class Corex(object):
         'empirical' does an empirical gaussianization (but this cannot be inverted).
         'outliers' tries to squeeze in the outliers
         Any other choice will skip the transformation."""
+        x = np.asarray(x, dtype=self.dtype)
         if self.missing_values is not None:
             x, self.n_obs = mean_impute(x, self.missing_values)  # Creates a copy
         else:
@@ -399,21 +458,29 @@ class Corex(object):
         elif self.gaussianize == 'standard':
             if fit:
                 mean = np.mean(x, axis=0)
+                x = x - mean  # A centered copy, so the caller's data is left alone
                 # std = np.std(x, axis=0, ddof=0).clip(1e-10)
-                std = np.sqrt(np.sum((x - mean)**2, axis=0) / self.n_obs).clip(1e-10)
+                # Unlike np.sum(x**2), np.std or np.linalg.norm, this einsum does not allocate an n by nv square
+                std = np.sqrt(np.einsum('ij,ij->j', x, x) / self.n_obs).clip(1e-10)
                 self.theta = (mean, std)
-            x = ((x - self.theta[0]) / self.theta[1])
-            if np.max(np.abs(x)) > 6 and self.verbose:
+            else:
+                x = x - self.theta[0]
+            x /= self.theta[1]
+            if self.verbose and np.max(np.abs(x)) > 6:
                 print("Warning: outliers more than 6 stds away from mean. Consider using gaussianize='outliers'")
         elif self.gaussianize == 'outliers':
             if fit:
                 mean = np.mean(x, axis=0)
-                std = np.std(x, axis=0, ddof=0).clip(1e-10)
+                x = x - mean
+                std = np.sqrt(np.einsum('ij,ij->j', x, x) / len(x)).clip(1e-10)  # np.std(x, ddof=0), no temporary
                 self.theta = (mean, std)
-            x = g((x - self.theta[0]) / self.theta[1])  # g truncates long tails
+            else:
+                x = x - self.theta[0]
+            x /= self.theta[1]
+            x = g(x)  # g truncates long tails
         elif self.gaussianize == 'empirical':
             print("Warning: correct inversion/transform of empirical gauss transform not implemented.")
-            x = np.array([norm.ppf((rankdata(x_i) - 0.5) / len(x_i)) for x_i in x.T]).T
+            x = norm.ppf((rank_columns(x) - 0.5) / len(x)).astype(self.dtype)
         if self.gpu and fit:  # Don't return GPU matrices when only transforming
             x = cm.CUDAMatrix(x)
         return x
@@ -440,11 +507,75 @@ class Corex(object):
             np.fill_diagonal(cov, 1)
             return self.theta[1][:, np.newaxis] * self.theta[1] * cov
         else:
-            cov = np.einsum('ij,kj->ik', m["X_i Z_j"], m["X_i Y_j"])
+            cov = np.dot(m["X_i Z_j"], m["X_i Y_j"].T)
             np.fill_diagonal(cov, 1)
             return self.theta[1][:, np.newaxis] * self.theta[1] * cov
 
 
+def _permute_moments(m, order):
+    """Reorder the latent factors in a dictionary of moments, as if they were calculated with ws[order]."""
+    m = m.copy()
+    for k in ["uj", "rho", "Y_j^2", "invrho", "rhoinvrho", "Qij", "MI", "I(Y_j ; X)", "TCs", "TC_direct"]:
+        if k in m:
+            m[k] = m[k][order]
+    for k in ["X_i Y_j", "X_i Z_j"]:
+        if k in m:
+            m[k] = m[k][:, order]
+    for k in ["ry", "cy"]:
+        if k in m:
+            m[k] = m[k][np.ix_(order, order)]
+    return m
+
+
+def _mi(rho):
+    """MI = - 0.5 * log(1 - rho^2), in one buffer. log1p keeps small MIs accurate."""
+    mi = np.square(rho)
+    np.negative(mi, out=mi)
+    np.log1p(mi, out=mi)
+    mi *= -0.5
+    return mi
+
+
+def _gram(x):
+    """Return x.T.dot(x) using the symmetric rank-k BLAS update, which only computes one triangle."""
+    syrk = get_blas_funcs('syrk', (x,))
+    if np.isfortran(x):
+        xtx = syrk(1., x, trans=1)
+    else:
+        xtx = syrk(1., x.T)  # x.T is Fortran ordered, so BLAS uses it without a copy
+    xtx += np.triu(xtx, 1).T  # Fill in the lower triangle
+    return xtx
+
+
+def _grad_ns_numpy(ws, uj, rho, invrho, rhoinvrho, Qij, Qi, Si):
+    """Elementwise terms of the gradient in the non-synergistic case (the Hessian term is added separately)."""
+    grad = ws / (1. - uj[:, np.newaxis])
+    grad -= 2 * invrho * rhoinvrho / (1 + Si)
+    grad += invrho**2 * ((1 + rho**2) * Qij - 2 * rho * Si) / (1 - Si**2 + Qi)
+    return grad
+
+
+def _grad_ns_loops(ws, uj, rho, invrho, rhoinvrho, Qij, Qi, Si):
+    """Same as _grad_ns_numpy, written as a single pass over the columns so numba can fuse it."""
+    m, nv = ws.shape
+    grad = np.empty_like(ws)
+    for i in prange(nv):
+        a = 1 + Si[i]
+        b = 1 - Si[i]**2 + Qi[i]
+        for j in range(m):
+            ir = invrho[j, i]
+            r = rho[j, i]
+            grad[j, i] = ws[j, i] / (1. - uj[j]) - 2 * ir * rhoinvrho[j, i] / a \
+                + ir**2 * ((1 + r**2) * Qij[j, i] - 2 * r * Si[i]) / b
+    return grad
+
+
+if NUMBA_SUPPORT:
+    _grad_ns = njit(parallel=True, fastmath=True, cache=True)(_grad_ns_loops)
+else:
+    _grad_ns = _grad_ns_numpy
+
+
 def pick_n_hidden(data, repeat=1, verbose=False):
     """A helper function to pick the number of hidden factors / clusters to use."""
     # TODO: Use an efficient search strategy
@@ -467,6 +598,34 @@ def pick_n_hidden(data, repeat=1, verbose=False):
     return n - 1
 
 
+def _available_cpus():
+    """Number of CPUs this process may run on, which can be fewer than the machine has."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def argsort_columns(x, min_size=100000):
+    """np.argsort(x, axis=0), with blocks of columns sorted in parallel threads for large x.
+    NumPy releases the GIL while sorting, so the threads run concurrently."""
+    n_jobs = min(_available_cpus(), x.shape[1])
+    if n_jobs < 2 or x.size < min_size:
+        return np.argsort(x, axis=0)
+    with ThreadPoolExecutor(n_jobs) as pool:
+        blocks = pool.map(lambda xb: np.argsort(xb, axis=0), np.array_split(x, n_jobs, axis=1))
+        return np.hstack(list(blocks))
+
+
+def rank_columns(x):
+    """Rank each column of x from 1 to n. Tied values get their average rank, like scipy.stats.rankdata."""
+    order = argsort_columns(x)
+    if np.any(np.diff(np.take_along_axis(x, order, axis=0), axis=0) == 0):
+        return rankdata(x, axis=0)  # Only fall back to scipy when there are ties to average
+    ranks = np.empty(x.shape)
+    np.put_along_axis(ranks, order, np.arange(1., len(x) + 1)[:, np.newaxis], axis=0)
+    return ranks
+
+
 def g(x, t=4):
     """A transformation that suppresses outliers for a standard normal."""
     xp = np.clip(x, -t, t)